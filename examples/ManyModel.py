@@ -81,14 +81,19 @@ def random_image_generator(batch_size, num_classes, input_shape):
     # better random images being generated for every yield. They were moved out of the while loop
     # to speed up the generator since the intent of this example is to show resolutions with
     # and without TFLMS versus a good data spread and loss / accuracy numbers.
-    templates = 2 * num_classes * np.random.random((num_classes,) + input_shape)
-    random_data = np.random.normal(loc=0, scale=1., size=input_shape)
+    # The source data is kept in float32 so that each yield performs a
+    # single batch-sized float32 allocation, rather than materializing a
+    # float64 intermediate at twice the size and casting it down.
+    templates = (2 * num_classes *
+                 np.random.random((num_classes,) + input_shape)
+                 ).astype(np.float32)
+    random_data = np.random.normal(loc=0, scale=1.,
+                                   size=input_shape).astype(np.float32)
     while True:
         y = np.random.randint(0, num_classes, size=(batch_size,))
-        x = np.zeros((batch_size,) + input_shape, dtype=np.float32)
-        for i in range(batch_size):
-            x[i] = templates[y[i]] + random_data
-        x_array = np.array(x)
+        # Gather the templates for the whole batch with one fancy-indexed
+        # NumPy operation rather than a Python loop over the batch.
+        x_array = templates[y] + random_data
         y_array = tf.keras.utils.to_categorical(y, num_classes)
         yield(x_array, y_array)
 
@@ -19,12 +19,16 @@ import time
 import tensorflow as tf
 import statistics
 
+from collections import Counter
+
 from tensorflow.keras.callbacks import Callback
 from tensorflow.estimator import SessionRunHook
 
 _cudart = ctypes.CDLL('libcudart.so')
 nvtx=  ctypes.CDLL("libnvToolsExt.so")
 nvtx.nvtxMarkA.restype = None
+# Encoded once; on_batch_begin pushes this range on every batch.
+_NVTX_ITERATION_RANGE = ctypes.c_char_p("Iteration".encode("ascii"))
 
 STATS_KEYS = ['time', 'allocs', 'reclaim_ones',
               'reclaim_alls', 'defrags', 'gib_reclaimed', 'gib_defragged']
@@ -44,7 +48,7 @@ class CudaProfileCallback(Callback):
         if batch == self._end and self.epoch_keeper == self._epoch:
             print('Stopping cuda profiler')
             _cudart.cudaProfilerStop()
-        nvtx.nvtxRangePushA(ctypes.c_char_p("Iteration".encode("ascii")))
+        nvtx.nvtxRangePushA(_NVTX_ITERATION_RANGE)
     def on_batch_end(self, batch, logs=None):
         ret = nvtx.nvtxRangePop()
 
@@ -56,19 +60,27 @@ class LMSStats():
 
         self._start_stats = {key:0 for key in STATS_KEYS}
         self._end_stats = self._start_stats.copy()
-        self._cumulative_stats = self._start_stats.copy()
+        self._cumulative_stats = Counter(self._start_stats)
         self._num_steps = 0
         self._step_times = []
+        self._last_step_diff = {key:0 for key in STATS_KEYS}
+        # Resolve the tf.experimental getters once. _get_stats runs twice
+        # per step and each attribute lookup walks the TF lazy-loading
+        # module machinery before crossing into the C API.
+        self._stat_getters = [
+            ('allocs', tf.experimental.get_num_allocs, False),
+            ('reclaim_ones', tf.experimental.get_num_single_reclaims, False),
+            ('reclaim_alls', tf.experimental.get_num_full_reclaims, False),
+            ('defrags', tf.experimental.get_num_defragmentations, False),
+            ('gib_reclaimed', tf.experimental.get_bytes_reclaimed, True),
+            ('gib_defragged', tf.experimental.get_bytes_defragged, True)]
 
     def _get_stats(self):
         stats = {}
         stats['time'] = time.time()
-        stats['allocs'] = tf.experimental.get_num_allocs(self._gpu_id)
-        stats['reclaim_ones'] = tf.experimental.get_num_single_reclaims(self._gpu_id)
-        stats['reclaim_alls'] = tf.experimental.get_num_full_reclaims(self._gpu_id)
-        stats['defrags'] = tf.experimental.get_num_defragmentations(self._gpu_id)
-        stats['gib_reclaimed'] = tf.experimental.get_bytes_reclaimed(self._gpu_id) / 1073741824.0
-        stats['gib_defragged'] = tf.experimental.get_bytes_defragged(self._gpu_id) / 1073741824.0
+        for key, getter, in_gib in self._stat_getters:
+            value = getter(self._gpu_id)
+            stats[key] = value / 1073741824.0 if in_gib else value
         return stats
 
     def step_begin(self):
@@ -78,18 +90,22 @@ class LMSStats():
     def step_end(self):
         self._num_steps += 1
         self._end_stats = self._get_stats()
-        step_diff = self.get_last_step_difference()
+        step_diff = {k: self._end_stats[k] - self._start_stats[k]
+                     for k in STATS_KEYS}
+        # Counter.update adds values key-wise in C, replacing the Python
+        # per-key accumulation loop.
+        self._cumulative_stats.update(step_diff)
+        self._last_step_diff = step_diff
         self._step_times.append(step_diff['time'])
-        for key in STATS_KEYS:
-            self._cumulative_stats[key] += step_diff[key]
-        self._cumulative_stats['num_steps'] = self._num_steps
         return self._end_stats.copy()
 
     def get_last_step_difference(self):
-        return {k: self._end_stats[k]-self._start_stats[k] for k in STATS_KEYS}
+        return self._last_step_diff.copy()
 
     def get_cumulative_stats(self):
-        return self._cumulative_stats.copy()
+        stats = self._cumulative_stats.copy()
+        stats['num_steps'] = self._num_steps
+        return stats
 
     def get_average_stats(self):
         if self._num_steps:
@@ -107,16 +123,20 @@ class LMSStats():
             return 0
         return statistics.median(self._step_times)
 
+def _step_stats_row(step_type, epoch, step_num, step_stats):
+        return [step_type, epoch, step_num,
+                step_stats['time'],
+                step_stats['allocs'],
+                step_stats['reclaim_ones'],
+                step_stats['reclaim_alls'],
+                step_stats['defrags'],
+                step_stats['gib_reclaimed'],
+                step_stats['gib_defragged']]
+
+
 # writes the stats from the last call to step_end to the log file
 def write_step_stats(logfile, step_type, epoch, step_num, step_stats):
-        row = [step_type, epoch, step_num]
-        row.append(step_stats['time'])
-        row.append(step_stats['allocs'])
-        row.append(step_stats['reclaim_ones'])
-        row.append(step_stats['reclaim_alls'])
-        row.append(step_stats['defrags'])
-        row.append(step_stats['gib_reclaimed'])
-        row.append(step_stats['gib_defragged'])
+        row = _step_stats_row(step_type, epoch, step_num, step_stats)
         with open(logfile, 'a+', newline='') as csvfile:
             statswriter = csv.writer(csvfile)
             statswriter.writerow(row)
@@ -136,10 +156,24 @@ class LMSStatsLogger(Callback):
         self._epoch=0
         self._logfile = logfile
         self._lms_stats = LMSStats(gpu_id=gpu_id)
+        self._csvfile = None
+        self._statswriter = None
 
     def set_params(self, params):
         write_step_log_header(self._logfile)
 
+    def _write_row(self, step_type, batch):
+        # Keep the log open across steps; reopening the file and
+        # rebuilding the csv writer per batch costs far more than the
+        # row itself. The flush keeps rows visible if training dies.
+        if self._statswriter is None:
+            self._csvfile = open(self._logfile, 'a+', newline='')
+            self._statswriter = csv.writer(self._csvfile)
+        step_diff = self._lms_stats.get_last_step_difference()
+        self._statswriter.writerow(
+            _step_stats_row(step_type, self._epoch, batch, step_diff))
+        self._csvfile.flush()
+
     def on_epoch_begin(self, epoch, logs=None):
         self._epoch = epoch
 
@@ -154,34 +188,40 @@ class LMSStatsLogger(Callback):
 
     def on_train_batch_end(self, batch, logs=None):
         self._lms_stats.step_end()
-        step_diff = self._lms_stats.get_last_step_difference()
-        write_step_stats(self._logfile, 't', self._epoch, batch, step_diff)
+        self._write_row('t', batch)
 
     def on_test_batch_end(self, batch, logs=None):
         self._lms_stats.step_end()
-        step_diff = self._lms_stats.get_last_step_difference()
-        write_step_stats(self._logfile, 'v', self._epoch, batch, step_diff)
+        self._write_row('v', batch)
+
+    def on_train_end(self, logs=None):
+        if self._csvfile is not None:
+            self._csvfile.close()
+            self._csvfile = None
+            self._statswriter = None
 
 
 class LMSStatsTrainingStepsAverage(Callback):
     def __init__(self, gpu_id=0):
         self._epoch=0
         self._lms_stats = LMSStats(gpu_id=gpu_id)
+        self._first_epoch = True
 
     def on_epoch_begin(self, epoch, logs=None):
         self._epoch = epoch
+        self._first_epoch = epoch == 0
 
     def on_train_batch_begin(self, batch, logs=None):
         # Do not record the first step of the first epoch as it contains
         # TensorFlow startup overhead
-        if (batch == 0) and (self._epoch == 0):
+        if self._first_epoch and (batch == 0):
             return
         self._lms_stats.step_begin()
 
     def on_train_batch_end(self, batch, logs=None):
         # Do not record the first step of the first epoch as it contains
         # TensorFlow startup overhead
-        if (batch == 0) and (self._epoch == 0):
+        if self._first_epoch and (batch == 0):
             return
         self._lms_stats.step_end()
 
@@ -194,10 +234,14 @@ class LMSStatsLoggerRunHook(SessionRunHook):
         self._logfile = logfile
         self._lms_stats = LMSStats(gpu_id=gpu_id)
         self._step = 0
+        self._csvfile = None
+        self._statswriter = None
 
     # Estimator SessionRunHook methods
     def begin(self):
         write_step_log_header(self._logfile)
+        self._csvfile = open(self._logfile, 'a+', newline='')
+        self._statswriter = csv.writer(self._csvfile)
 
     def before_run(self, run_context):
         self._lms_stats.step_begin()
@@ -206,7 +250,15 @@ class LMSStatsLoggerRunHook(SessionRunHook):
     def after_run(self, run_context, run_values):
         self._lms_stats.step_end()
         step_diff = self._lms_stats.get_last_step_difference()
-        write_step_stats(self._logfile, 't', 0, self._step, step_diff)
+        self._statswriter.writerow(
+            _step_stats_row('t', 0, self._step, step_diff))
+        self._csvfile.flush()
+
+    def end(self, session):
+        if self._csvfile is not None:
+            self._csvfile.close()
+            self._csvfile = None
+            self._statswriter = None
 
 
 class LMSStatsAverage(Callback):
@@ -220,14 +272,16 @@ class LMSStatsAverage(Callback):
         self._num_dims = image_dimensions
         self._dim = image_size
         self._batch_size = batch_size
+        self._record_this_epoch = self._epoch >= self._start_epoch
 
     def _should_record(self, batch):
-        if (batch >= self._start_batch) and (self._epoch >= self._start_epoch):
-            return True
-        return False
+        # The epoch half of the test is evaluated once per epoch; the
+        # per-batch check is just the batch threshold.
+        return self._record_this_epoch and (batch >= self._start_batch)
 
     def on_epoch_begin(self, epoch, logs=None):
         self._epoch = epoch
+        self._record_this_epoch = epoch >= self._start_epoch
 
     def on_train_batch_begin(self, batch, logs=None):
         if not self._should_record(batch):